@@ -1,19 +1,50 @@
+import contextlib
+import contextvars
+import gzip
+import io
+import mimetypes
 import os
 import re
+import shutil
 import subprocess
 import json
+import hashlib
+import tempfile
 import threading
 import time
-from flask import Flask, request, send_file, abort, jsonify, Response, send_from_directory
+import unicodedata
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlparse
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: no cross-worker coalescing
+    fcntl = None
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+from flask import Flask, request, send_file, abort, jsonify, Response, g
 from flask_cors import CORS, cross_origin
 
+# Metrics from all gunicorn workers are merged through files in this dir;
+# gunicorn.conf.py sets and clears it. A bare `python app.py` gets its own.
+if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+else:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 BUILD_DIR = os.path.join(BASE_DIR, "frontend", "MP3Converter", "dist")
 
 app = Flask(
     __name__,
-    static_folder=BUILD_DIR,    # where your built files live
-    static_url_path=""          # mount them at the webroot
+    static_folder=None          # serve_spa serves the build from an in-memory index
 )
 
 cors = CORS(app, origins=["http://localhost:5173"])
@@ -25,48 +56,554 @@ ALLOWED_FORMATS = {"mp3", "aac", "alac", "flac", "wav", "ogg"}
 ALLOWED_BITRATE = {"128", "192", "256", "320"}
 FAST_FORMATS = {"mp3", "aac"}
 QUALITY_FORMATS = {"alac", "flac", "wav", "ogg"}
+LOSSLESS_FORMATS = {"alac", "flac", "wav"}
+EXT_MAP = {
+    "mp3":  "mp3",
+    "aac":  "m4a",
+    "alac": "m4a",
+    "flac": "flac",
+    "wav":  "wav",
+    "ogg":  "ogg"
+}
+BATCH_MAX_TARGETS = 8
+
+# Source codecs ffmpeg can copy straight into each target's container
+COPY_CODECS = {
+    "mp3":  ("mp3",),
+    "aac":  ("mp4a",),
+    "alac": ("alac",),
+    "flac": ("flac",),
+    "ogg":  ("opus", "vorbis"),
+}
+FAST_SOURCE = "bestaudio/best"
+
+# Live streaming: containers that can be written to a pipe and played as
+# they arrive (fragmented MP4 for the m4a targets)
+STREAM_CONTAINERS = {
+    "mp3":  ["-f", "mp3"],
+    "aac":  ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"],
+    "alac": ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"],
+    "flac": ["-f", "flac"],
+    "wav":  ["-f", "wav"],
+    "ogg":  ["-f", "ogg"],
+}
+MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "aac": "audio/aac",
+    "m4a": "audio/mp4",
+    "alac": "audio/mp4",  # fast mode keeps yt-dlp's .alac extension
+    "flac": "audio/flac",
+    "wav": "audio/wav",
+    "ogg": "audio/ogg"
+}
+STREAM_TIMEOUT = int(os.environ.get("STREAM_TIMEOUT", 600))
+STREAM_AHEAD_BYTES = 1024 * 1024
+STREAM_HISTORY_BYTES = 32 * 1024 * 1024
+stream_ttfb = deque(maxlen=1000)  # seconds, most recent streams
+
+# Metrics. format_args and batch_targets check format and bitrate against
+# the ALLOWED_* sets, so label values stay bounded.
+STAGE_LABELS = ["stage", "method", "format", "bitrate"]
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+STAGE_SECONDS = Histogram(
+    "soundscape_stage_seconds", "Wall time of each yt-dlp/ffmpeg/send stage",
+    STAGE_LABELS, buckets=SECONDS_BUCKETS)
+STAGE_RUNS = Counter(
+    "soundscape_stage_runs_total", "Subprocess runs by exit code",
+    STAGE_LABELS + ["exit_code"])
+STAGE_BYTES = Counter(
+    "soundscape_stage_output_bytes_total", "Bytes produced by each stage", STAGE_LABELS)
+REQUEST_SECONDS = Histogram(
+    "soundscape_request_seconds", "Request time including sending the body",
+    ["endpoint", "method", "format", "bitrate", "status"], buckets=SECONDS_BUCKETS)
+STREAM_TTFB = Histogram(
+    "soundscape_stream_ttfb_seconds", "Time to the first streamed byte",
+    ["format", "bitrate"], buckets=SECONDS_BUCKETS)
+INFLIGHT_JOBS = Gauge(
+    "soundscape_inflight_jobs", "Conversions queued or running", multiprocess_mode="livesum")
+CHILD_PROCESSES = Gauge(
+    "soundscape_child_processes", "Running yt-dlp/ffmpeg processes", multiprocess_mode="livesum")
+
+# Per-request list of (stage, seconds) for the Server-Timing header. Work
+# handed to the pools runs in a copy of the request's context, so it
+# appends to the same list.
+stage_timings = contextvars.ContextVar("stage_timings", default=None)
+QUALITY_SOURCE = "bestaudio[ext=m4a]/bestaudio"
+
+# Playlist / bulk conversion
+PLAYLIST_CONCURRENCY = int(os.environ.get("PLAYLIST_CONCURRENCY", 4))
+PLAYLIST_PER_HOST = int(os.environ.get("PLAYLIST_PER_HOST", 2))
+PLAYLIST_MAX_ENTRIES = int(os.environ.get("PLAYLIST_MAX_ENTRIES", 100))
+host_slots = {}
+host_slots_lock = threading.Lock()
+
+# Finished conversions are kept here, one file per (video, format, bitrate, method)
+CACHE_DIR = os.path.join(DOWNLOAD_DIR, "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CACHE_MAX_AGE = int(os.environ.get("CACHE_MAX_AGE", 7 * 24 * 3600))
+WORK_DIR_MAX_AGE = 3600
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Conversion jobs: network-bound fast downloads and CPU-bound ffmpeg encodes
+# get separate pools so a burst of FLAC jobs can't starve MP3 users
+JOBS_DIR = os.path.join(DOWNLOAD_DIR, "jobs")
+FAST_CONCURRENCY = int(os.environ.get("FAST_CONCURRENCY", 4))
+QUALITY_CONCURRENCY = int(os.environ.get("QUALITY_CONCURRENCY", os.cpu_count() or 2))
+# Inline downloads, streams and SSE subscribers each hold a request thread
+# (gunicorn.conf.py exports --threads as WORKER_THREADS), so the defaults
+# leave a couple free to answer 429s, polls and static files
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 8))
+EVENT_STREAMS_MAX = int(os.environ.get("EVENT_STREAMS_MAX", max(WORKER_THREADS // 4, 1)))
+JOB_QUEUE_LIMIT = int(os.environ.get(
+    "JOB_QUEUE_LIMIT", max(WORKER_THREADS - EVENT_STREAMS_MAX - 2, 1)))
+JOB_TTL = 3600
+os.makedirs(JOBS_DIR, exist_ok=True)
+
+fast_pool = ThreadPoolExecutor(FAST_CONCURRENCY, thread_name_prefix="fast")
+quality_pool = ThreadPoolExecutor(QUALITY_CONCURRENCY, thread_name_prefix="quality")
+pending_jobs = 0
+pending_lock = threading.Lock()
+event_streams = 0
+
+# Identical requests in flight share one pipeline (singleflight), keyed by cache key
+inflight_jobs = {}
+inflight_streams = {}
+streams_lock = threading.Lock()
+
+YTDLP_PROGRESS_RE = re.compile(r'^\[download\]\s+(\d+(?:\.\d+)?)%')
+FFMPEG_PROGRESS_RE = re.compile(r'^out_time_(?:us|ms)=(\d+)')
+
+# Resolved yt-dlp info, keyed by video id. Format URLs in it expire after a
+# few hours, so entries must be dropped well before that.
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", 1800))
+INFO_CACHE_SIZE = int(os.environ.get("INFO_CACHE_SIZE", 512))
+info_cache = OrderedDict()
+info_lock = threading.Lock()
+# Fields a download never reads. On YouTube (captions, heatmap, thumbnails)
+# they are most of the JSON, and every cached entry holds a copy.
+INFO_DROP_FIELDS = {"automatic_captions", "subtitles", "heatmap", "thumbnails",
+                    "description", "chapters", "comments", "tags", "categories"}
+
+# /search results keyed by normalized query: an LRU in each worker, backed
+# by JSON files in SEARCH_DIR that every gunicorn worker can read
+SEARCH_DIR = os.path.join(DOWNLOAD_DIR, "search")
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 600))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 256))
+search_cache = OrderedDict()
+search_lock = threading.Lock()
+os.makedirs(SEARCH_DIR, exist_ok=True)
+
+# Speculative prefetch of the top search hits, off by default. SEARCH_PREFETCH
+# hits get full metadata; the first SEARCH_PREFETCH_AUDIO are also converted
+# to PREFETCH_TARGET so the click that follows is a cache hit. Prefetch only
+# runs while no real conversions are pending, on its own small pool, and
+# audio stops once PREFETCH_BYTES_PER_HOUR has been fetched in the last hour.
+SEARCH_PREFETCH = int(os.environ.get("SEARCH_PREFETCH", 0))
+SEARCH_PREFETCH_AUDIO = int(os.environ.get("SEARCH_PREFETCH_AUDIO", 0))
+PREFETCH_FORMAT, _, PREFETCH_BITRATE = os.environ.get("PREFETCH_TARGET", "mp3:320").partition(":")
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", 1))
+PREFETCH_BYTES_PER_HOUR = int(os.environ.get("PREFETCH_BYTES_PER_HOUR", 512 * 1024 ** 2))
+prefetch_pool = ThreadPoolExecutor(PREFETCH_CONCURRENCY, thread_name_prefix="prefetch")
+prefetching = set()
+prefetch_bytes = deque()  # (time, size) of prefetched audio
+prefetch_lock = threading.Lock()
+
+VIDEO_ID_RE = re.compile(
+    r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
 
 
 def sanitize_filename(name: str) -> str:
     return re.sub(r'[<>:"/\\|?*]', '', name).strip()[:100]
 
 
-def wipe_downloads(delay=1):
-    time.sleep(delay)
-    for fname in os.listdir(DOWNLOAD_DIR):
+def video_id(youtube_url: str) -> str:
+    """Canonical id for a URL; falls back to a hash for non-YouTube links."""
+    m = VIDEO_ID_RE.search(youtube_url)
+    if m:
+        return m.group(1)
+    return "url-" + hashlib.sha256(youtube_url.encode()).hexdigest()[:16]
+
+
+def cache_key(youtube_url: str, audio_format: str, bitrate: str, method: str) -> str:
+    # bitrate is ignored by lossless targets and by fast-mode AAC, so leave
+    # it out of the key there to avoid storing identical files twice
+    if audio_format in LOSSLESS_FORMATS or (method == "fast" and audio_format == "aac"):
+        bitrate = ""
+    raw = "|".join([video_id(youtube_url), audio_format, bitrate, method])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def cache_meta(key: str) -> dict:
+    """Metadata stored alongside a cached conversion ({} on a miss)."""
+    try:
+        with open(os.path.join(CACHE_DIR, f"{key}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cache_lookup(key: str):
+    """Return (path, title) for a cached conversion, or None on a miss."""
+    meta = cache_meta(key)
+    try:
+        path = os.path.join(CACHE_DIR, f"{key}.{meta['ext']}")
+        os.utime(path)  # mtime doubles as the LRU timestamp
+    except (OSError, ValueError, KeyError):
+        return None
+    return path, meta.get("title", "audio")
+
+
+def cache_publish(key: str, src: str, title: str, plan=None) -> str:
+    """Atomically move a finished file from a work dir into the cache.
+
+    The media file lands first; the metadata file is what makes it visible
+    to cache_lookup, so readers never see a half-published entry.
+    """
+    ext = src.rsplit(".", 1)[1]
+    final = os.path.join(CACHE_DIR, f"{key}.{ext}")
+    os.replace(src, final)
+    meta_tmp = os.path.join(os.path.dirname(src), f"{key}.json")
+    with open(meta_tmp, "w") as f:
+        json.dump({"title": title, "ext": ext, "plan": plan}, f)
+    os.replace(meta_tmp, os.path.join(CACHE_DIR, f"{key}.json"))
+    return final
+
+
+@contextlib.contextmanager
+def cache_lock(key: str):
+    """Exclusive per-key lock shared by all gunicorn workers on this host."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(CACHE_DIR, f"{key}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def evict_cache():
+    """Drop expired entries, then least recently used ones until under budget."""
+    now = time.time()
+    entries = []
+    for fn in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, fn)
+        if fn.endswith(".lock"):
+            # no conversion holds a lock anywhere near this long
+            try:
+                if now - os.stat(path).st_mtime > WORK_DIR_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+            continue
+        if fn.endswith(".json"):
+            continue
         try:
-            os.remove(os.path.join(DOWNLOAD_DIR, fname))
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if total <= CACHE_MAX_BYTES and now - mtime <= CACHE_MAX_AGE:
+            continue
+        key = os.path.basename(path).split(".", 1)[0]
+        for victim in (os.path.join(CACHE_DIR, f"{key}.json"), path):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        total -= size
+
+    for fn in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, fn)
+        try:
+            if now - os.stat(path).st_mtime > JOB_TTL:
+                os.remove(path)
         except OSError:
             pass
 
+    # work dirs left behind by killed workers
+    for fn in os.listdir(DOWNLOAD_DIR):
+        path = os.path.join(DOWNLOAD_DIR, fn)
+        if fn.startswith("work-"):
+            try:
+                if now - os.stat(path).st_mtime > WORK_DIR_MAX_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+
+def stage_labels(method: str = "", audio_format: str = "", bitrate: str = "") -> dict:
+    if audio_format in LOSSLESS_FORMATS:
+        bitrate = ""
+    return {"method": method, "format": audio_format, "bitrate": bitrate}
+
+
+def record_stage(stage: str, labels: dict, seconds: float, exit_code=None, nbytes: int = 0):
+    STAGE_SECONDS.labels(stage=stage, **labels).observe(seconds)
+    if exit_code is not None:
+        STAGE_RUNS.labels(stage=stage, exit_code=exit_code, **labels).inc()
+    if nbytes:
+        STAGE_BYTES.labels(stage=stage, **labels).inc(nbytes)
+    timings = stage_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
 
-def get_video_info(youtube_url: str) -> dict:
-    proc = subprocess.run(
+
+def run_tool(stage: str, cmd: list, labels: dict = None, **kwargs):
+    """subprocess.run, timed and counted as a stage; bytes are stdout's."""
+    labels = labels or stage_labels()
+    start = time.perf_counter()
+    exit_code, nbytes = "error", 0
+    CHILD_PROCESSES.inc()
+    try:
+        proc = subprocess.run(cmd, **kwargs)
+        exit_code, nbytes = str(proc.returncode), len(proc.stdout or "")
+        return proc
+    except subprocess.TimeoutExpired:
+        exit_code = "timeout"
+        raise
+    except subprocess.CalledProcessError as e:
+        exit_code, nbytes = str(e.returncode), len(e.stdout or "")
+        raise
+    finally:
+        CHILD_PROCESSES.dec()
+        record_stage(stage, labels, time.perf_counter() - start, exit_code, nbytes)
+
+
+def run_with_progress(cmd: list, on_line=None, timeout=None, stage: str = "tool",
+                      labels: dict = None, produces=None):
+    """Like subprocess.run(cmd, check=True, timeout=...) but hands every
+    stdout line to on_line as it arrives.
+
+    The run is recorded as a stage; produces() is called after a clean exit
+    to count the bytes it wrote.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    CHILD_PROCESSES.inc()
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        for line in proc.stdout:
+            if on_line:
+                on_line(line)
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        CHILD_PROCESSES.dec()
+        exit_code = "timeout" if timed_out.is_set() else str(proc.returncode)
+        nbytes = 0
+        if proc.returncode == 0 and produces:
+            try:
+                nbytes = produces()
+            except OSError:
+                pass
+        record_stage(stage, labels or stage_labels(), time.perf_counter() - start,
+                     exit_code, nbytes)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def ytdlp_progress(progress, stage: str, lo: float, hi: float):
+    """Line callback mapping yt-dlp's download percentage onto [lo, hi]."""
+    def on_line(line):
+        m = YTDLP_PROGRESS_RE.match(line.strip())
+        if m and progress:
+            progress(stage, lo + (hi - lo) * float(m.group(1)) / 100)
+    return on_line
+
+
+def ffmpeg_progress(progress, stage: str, lo: float, hi: float, duration):
+    """Line callback for `ffmpeg -progress pipe:1`, scaled by the input duration."""
+    def on_line(line):
+        m = FFMPEG_PROGRESS_RE.match(line.strip())
+        if m and progress and duration:
+            done = min(int(m.group(1)) / 1e6 / duration, 1.0)
+            progress(stage, lo + (hi - lo) * done)
+    return on_line
+
+
+def slim_info(raw: dict) -> dict:
+    """raw without INFO_DROP_FIELDS or video-only/storyboard formats, which
+    an audio download (--load-info-json included) has no use for."""
+    slim = {k: v for k, v in raw.items() if k not in INFO_DROP_FIELDS}
+    if "formats" in slim:
+        slim["formats"] = [f for f in slim["formats"] if f.get("acodec") != "none"]
+    return slim
+
+
+def remember_info(youtube_url: str, raw: dict, full: bool = True) -> dict:
+    """Store yt-dlp info in the metadata cache and return the trimmed view.
+
+    Partial entries (full=False, e.g. flat /search results) carry a title and
+    duration but can't be handed back to yt-dlp, so they never replace a
+    live full entry.
+    """
+    raw = slim_info(raw)
+    info = {
+        "title": sanitize_filename(raw.get("title") or "audio"),
+        "duration": raw.get("duration"),
+        "formats": raw.get("formats", []),
+        "raw": raw if full else None
+    }
+    vid = video_id(youtube_url)
+    now = time.time()
+    with info_lock:
+        old = info_cache.get(vid)
+        if not full and old and old[0] > now and old[1]["raw"] is not None:
+            return old[1]
+        info_cache[vid] = (now + INFO_CACHE_TTL, info)
+        info_cache.move_to_end(vid)
+        while len(info_cache) > INFO_CACHE_SIZE:
+            info_cache.popitem(last=False)
+    return info
+
+
+def cached_info(youtube_url: str, full: bool = True):
+    vid = video_id(youtube_url)
+    with info_lock:
+        entry = info_cache.get(vid)
+        if entry is None:
+            return None
+        expires, info = entry
+        if expires < time.time():
+            del info_cache[vid]
+            return None
+        if full and info["raw"] is None:
+            return None
+        info_cache.move_to_end(vid)
+        return info
+
+
+def get_video_info(youtube_url: str, full: bool = True) -> dict:
+    info = cached_info(youtube_url, full)
+    if info:
+        return info
+    proc = run_tool(
+        "info",
         ["yt-dlp", "--dump-json", "--no-warnings", youtube_url],
         capture_output=True, text=True, check=True
     )
-    info = json.loads(proc.stdout)
+    return remember_info(youtube_url, json.loads(proc.stdout))
+
+
+def ytdlp_source(youtube_url: str, work_dir: str):
+    """yt-dlp arguments naming what to download, plus the cached info if any.
+
+    With cached info yt-dlp replays it via --load-info-json and skips the
+    extractor; otherwise it resolves the page once. Either way callers add
+    --write-info-json, which records the format yt-dlp actually picked.
+    """
+    info = cached_info(youtube_url)
+    if info is None:
+        return [youtube_url], None
+    path = os.path.join(work_dir, "source.info.json")
+    with open(path, "w") as f:
+        json.dump(info["raw"], f)
+    return ["--load-info-json", path], info
+
+
+def downloaded_info(youtube_url: str, work_dir: str, info):
+    """(info, chosen) for a finished download.
+
+    chosen is the --write-info-json record, whose top-level fields describe
+    the format that was downloaded. On a cold cache it also seeds the info.
+    """
+    with open(os.path.join(work_dir, "download.info.json")) as f:
+        chosen = json.load(f)
+    if info is None:
+        info = remember_info(youtube_url, chosen)
+    return info, chosen
+
+
+def can_copy(source: dict, audio_format: str, bitrate=None) -> bool:
+    """Whether ffmpeg can remux this source format into the target as-is."""
+    codec = (source.get("acodec") or "").split(".")[0]
+    if codec not in COPY_CODECS.get(audio_format, ()):
+        return False
+    # don't hand back a noticeably bigger stream than the bitrate asked for
+    abr = source.get("abr")
+    return not (bitrate and abr and audio_format not in LOSSLESS_FORMATS
+                and abr > int(bitrate) * 1.1)
+
+
+def plan_conversion(formats: list, audio_format: str, bitrate=None) -> dict:
+    """Pick the source to download and whether it can be stream-copied.
+
+    Prefers the best audio-only format whose codec already fits the target
+    (mode "copy"); otherwise the best m4a, then any audio (mode "encode").
+    """
+    audio = [f for f in formats
+             if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")]
+    copyable = [f for f in audio if can_copy(f, audio_format, bitrate)]
+    candidates = copyable or [f for f in audio if f.get("ext") == "m4a"] or audio
+    if not candidates:
+        return {"mode": "encode", "format_id": None, "acodec": None, "abr": None}
+    source = max(candidates, key=lambda f: f.get("abr") or f.get("tbr") or 0)
     return {
-        "title": sanitize_filename(info.get("title", "audio")),
-        "duration": info.get("duration"),
-        "formats": info.get("formats", [])
+        "mode": "copy" if copyable else "encode",
+        "format_id": source.get("format_id"),
+        "acodec": source.get("acodec"),
+        "abr": source.get("abr")
     }
 
 
-def fast_download_ytdlp(youtube_url: str, audio_format: str, bitrate: str):
-    info = get_video_info(youtube_url)
-    title = info["title"]
-    raw_template = os.path.join(DOWNLOAD_DIR, f"{title}.download.%(ext)s")
+def source_selector(info, audio_format: str, bitrate, fallback: str) -> str:
+    """yt-dlp -f expression that lands on a copyable source when there is one."""
+    if info is not None:
+        plan = plan_conversion(info["formats"], audio_format, bitrate)
+        return plan["format_id"] if plan["mode"] == "copy" else fallback
+    # cold cache: let yt-dlp apply the same preference while it resolves
+    cap = ""
+    if bitrate and audio_format not in LOSSLESS_FORMATS:
+        cap = f"[abr<=?{int(int(bitrate) * 1.1)}]"
+    parts = [f"bestaudio[acodec^={codec}]{cap}" for codec in COPY_CODECS.get(audio_format, ())]
+    return "/".join(parts + [fallback])
+
+
+def downloaded_file(work_dir: str):
+    for fn in os.listdir(work_dir):
+        if fn.startswith("download.") and not fn.endswith(".info.json"):
+            return os.path.join(work_dir, fn)
+    return None
+
+
+def fast_download_ytdlp(youtube_url: str, audio_format: str, bitrate: str, work_dir: str = DOWNLOAD_DIR, progress=None):
+    source, info = ytdlp_source(youtube_url, work_dir)
+    raw_template = os.path.join(work_dir, "download.%(ext)s")
 
+    # yt-dlp already copies instead of re-encoding when the source codec
+    # matches --audio-format, so all we need to do is ask for that source
     cmd = [
         "yt-dlp",
-        "-f", "bestaudio/best",
+        "-f", source_selector(info, audio_format, None, FAST_SOURCE),
         "--extract-audio",
         "--audio-format", audio_format,
         "--no-warnings",
         "--no-playlist",
         "--force-overwrites",            # overwrite if exists
-        youtube_url,
+        "--newline",                     # one progress line per update
+        "--write-info-json",
+        *source,
         "-o", raw_template
     ]
     if audio_format == "mp3":
@@ -74,136 +611,559 @@ def fast_download_ytdlp(youtube_url: str, audio_format: str, bitrate: str):
     elif audio_format == "aac":
         cmd += ["--audio-quality", "256K"]
 
-    subprocess.run(cmd, check=True, timeout=120)
+    # yt-dlp runs ffmpeg itself after the download, so leave headroom for that
+    run_with_progress(cmd, ytdlp_progress(progress, "download", 0, 90), timeout=120,
+                      stage="download", labels=stage_labels("fast", audio_format, bitrate),
+                      produces=lambda: os.path.getsize(downloaded_file(work_dir)))
+
+    info, chosen = downloaded_info(youtube_url, work_dir, info)
+    title = info["title"]
+    plan = plan_conversion([chosen], audio_format)
 
     # locate the downloaded file
-    for fn in os.listdir(DOWNLOAD_DIR):
-        if fn.startswith(f"{title}.download."):
-            path = os.path.join(DOWNLOAD_DIR, fn)
-            final = os.path.join(DOWNLOAD_DIR, f"{title}.{audio_format}")
-            if path != final:
-                os.replace(path, final)
-            return final, title
+    path = downloaded_file(work_dir)
+    if not path:
+        raise FileNotFoundError("Fast download: file not found")
+    final = os.path.join(work_dir, f"{title}.{audio_format}")
+    os.replace(path, final)
+    return final, title, plan
 
-    raise FileNotFoundError("Fast download: file not found")
 
+def fetch_raw_audio(youtube_url: str, work_dir: str, progress=None, target=None):
+    """Download source audio untouched; returns (raw_file, info, chosen).
 
-def quality_download_ffmpeg(youtube_url: str, audio_format: str, bitrate: str):
-    info = get_video_info(youtube_url)
-    title = info["title"]
-    raw_template = os.path.join(DOWNLOAD_DIR, f"{title}.download.%(ext)s")
+    With a (format, bitrate) target, a source that can be stream-copied into
+    it is preferred; chosen is the info of the format actually downloaded.
+    """
+    source, info = ytdlp_source(youtube_url, work_dir)
+    raw_template = os.path.join(work_dir, "download.%(ext)s")
+    selector = source_selector(info, *target, QUALITY_SOURCE) if target else QUALITY_SOURCE
 
-    # 1) Download best-quality audio
     dl_cmd = [
         "yt-dlp",
-        "-f", "bestaudio[ext=m4a]/bestaudio",
+        "-f", selector,
         "--no-playlist",
         "--no-warnings",
-        youtube_url,
+        "--newline",
+        "--write-info-json",
+        *source,
         "-o", raw_template
     ]
-    subprocess.run(dl_cmd, check=True, timeout=120)
+    labels = stage_labels("quality", *target) if target else stage_labels("batch")
+    run_with_progress(dl_cmd, ytdlp_progress(progress, "download", 0, 50), timeout=120,
+                      stage="download", labels=labels,
+                      produces=lambda: os.path.getsize(downloaded_file(work_dir)))
+    info, chosen = downloaded_info(youtube_url, work_dir, info)
 
-    # find raw file
-    raw_file = None
-    for fn in os.listdir(DOWNLOAD_DIR):
-        if fn.startswith(f"{title}.download."):
-            raw_file = os.path.join(DOWNLOAD_DIR, fn)
-            break
+    raw_file = downloaded_file(work_dir)
     if not raw_file:
         raise FileNotFoundError("Quality download: raw file not found")
+    return raw_file, info, chosen
 
-    # 2) Convert with FFmpeg
-    ext_map = {
-        "mp3":  "mp3",
-        "aac":  "m4a",
-        "alac": "m4a",
-        "flac": "flac",
-        "wav":  "wav",
-        "ogg":  "ogg"
-    }
-    final_ext = ext_map[audio_format]
-    out_file = os.path.join(DOWNLOAD_DIR, f"{title}.{final_ext}")
 
-    cmd = [
-        "ffmpeg",
-        "-hide_banner",
-        "-loglevel", "error",
-        "-y",
-        "-i", raw_file,
-        "-vn"
-    ]
+def ffmpeg_codec_args(audio_format: str, bitrate: str) -> list:
     if audio_format == "mp3":
-        cmd += ["-c:a", "libmp3lame", "-b:a",
+        return ["-c:a", "libmp3lame", "-b:a",
                 f"{bitrate}k", "-ar", "44100", "-ac", "2", "-q:a", "2"]
     elif audio_format == "aac":
-        cmd += ["-c:a", "aac", "-b:a",
+        return ["-c:a", "aac", "-b:a",
                 f"{bitrate}k", "-ar", "44100", "-ac", "2", "-profile:a", "aac_low"]
+    # lossless targets keep the source sample rate instead of resampling
     elif audio_format == "alac":
-        cmd += ["-c:a", "alac", "-ar", "44100", "-ac", "2"]
+        return ["-c:a", "alac", "-ac", "2"]
     elif audio_format == "flac":
-        cmd += ["-c:a", "flac", "-compression_level",
-                "8", "-ar", "44100", "-ac", "2"]
+        return ["-c:a", "flac", "-compression_level", "8", "-ac", "2"]
     elif audio_format == "wav":
-        cmd += ["-c:a", "pcm_s16le", "-ar", "44100", "-ac", "2"]
+        return ["-c:a", "pcm_s16le", "-ac", "2"]
     elif audio_format == "ogg":
-        cmd += ["-c:a", "libvorbis", "-b:a",
+        return ["-c:a", "libvorbis", "-b:a",
                 f"{bitrate}k", "-ar", "44100", "-ac", "2"]
+    raise ValueError(f"Unsupported format: {audio_format}")
+
 
-    cmd.append(out_file)
-    subprocess.run(cmd, check=True, timeout=180)
+def ffmpeg_encode(raw_file: str, outputs: list, duration=None, progress=None):
+    """Encode raw_file to every (audio_format, bitrate, out_file, plan) in one pass.
+
+    ffmpeg decodes the source once and feeds each output's encoder, so extra
+    targets only cost their own encode; outputs planned as "copy" are
+    remuxed without decoding at all.
+    """
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-nostats",
+        "-progress", "pipe:1",
+        "-y",
+        "-i", raw_file
+    ]
+    for audio_format, bitrate, out_file, plan in outputs:
+        if plan["mode"] == "copy":
+            cmd += ["-vn", "-c:a", "copy", out_file]
+        else:
+            cmd += ["-vn", *ffmpeg_codec_args(audio_format, bitrate), out_file]
+    if len(outputs) == 1:
+        labels = stage_labels("quality", outputs[0][0], outputs[0][1])
+    else:
+        labels = stage_labels("batch")
+    run_with_progress(cmd, ffmpeg_progress(progress, "encode", 50, 100, duration), timeout=180,
+                      stage="encode", labels=labels,
+                      produces=lambda: sum(os.path.getsize(o[2]) for o in outputs))
+
+
+def quality_download_ffmpeg(youtube_url: str, audio_format: str, bitrate: str, work_dir: str = DOWNLOAD_DIR, progress=None):
+    # 1) Download best-quality audio, preferring a source we can copy
+    raw_file, info, chosen = fetch_raw_audio(youtube_url, work_dir, progress,
+                                             (audio_format, bitrate))
+    title = info["title"]
+    plan = plan_conversion([chosen], audio_format, bitrate)
+
+    # 2) Convert (or just remux) with FFmpeg
+    out_file = os.path.join(work_dir, f"{title}.{EXT_MAP[audio_format]}")
+    ffmpeg_encode(raw_file, [(audio_format, bitrate, out_file, plan)], info["duration"], progress)
 
     # cleanup raw
     os.remove(raw_file)
-    return out_file, title
+    return out_file, title, plan
+
+
+def batch_convert(youtube_url: str, targets: list, progress=None):
+    """Convert one video to several (format, bitrate) targets.
+
+    Cached targets are reused; the rest share a single source download and a
+    single multi-output ffmpeg run. Returns [(format, bitrate, path, title)].
+    """
+    keys = {}
+    for audio_format, bitrate in targets:
+        keys.setdefault(cache_key(youtube_url, audio_format, bitrate, "quality"),
+                        (audio_format, bitrate))
+
+    results = {key: cache_lookup(key) for key in keys}
+    missing = sorted(key for key, hit in results.items() if hit is None)
+    if missing:
+        with contextlib.ExitStack() as locks:
+            # sorted order, so two overlapping batches can't deadlock
+            for key in missing:
+                locks.enter_context(cache_lock(key))
+            for key in missing:
+                results[key] = cache_lookup(key)
+            missing = [key for key in missing if results[key] is None]
+
+            work_dir = tempfile.mkdtemp(prefix="work-", dir=DOWNLOAD_DIR)
+            try:
+                if missing:
+                    raw_file, info, chosen = fetch_raw_audio(youtube_url, work_dir, progress)
+                    outputs = []
+                    for key in missing:
+                        audio_format, bitrate = keys[key]
+                        out_file = os.path.join(work_dir, f"{key}.{EXT_MAP[audio_format]}")
+                        plan = plan_conversion([chosen], audio_format, bitrate)
+                        outputs.append((audio_format, bitrate, out_file, plan))
+                    ffmpeg_encode(raw_file, outputs, info["duration"], progress)
+                    for key, (_, _, out_file, plan) in zip(missing, outputs):
+                        results[key] = (cache_publish(key, out_file, info["title"], plan),
+                                        info["title"])
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        threading.Thread(target=evict_cache, daemon=True).start()
+
+    return [(*keys[key], *results[key]) for key in keys]
+
+
+class ZipSink(io.RawIOBase):
+    """Unseekable write buffer. zipfile notices it can't seek and falls back
+    to data descriptors, so an archive can be sent while it is being built."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    """Yield a zip64 archive of (arcname, bytes or open file) entries.
+
+    Entries are consumed lazily and never buffered whole; audio is already
+    compressed, so members are stored as-is.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, src in entries:
+            member = zipfile.ZipInfo(arcname, time.localtime()[:6])
+            with zf.open(member, "w", force_zip64=True) as dst:
+                if isinstance(src, bytes):
+                    dst.write(src)
+                else:
+                    with src:
+                        while True:
+                            chunk = src.read(65536)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+                            yield sink.drain()
+            data = sink.drain()
+            if data:  # an empty chunk would end a chunked response early
+                yield data
+    yield sink.drain()
+
+
+def reap(procs: list, grace: float = 5):
+    """Wait for child processes, escalating to terminate and kill, so none
+    are left behind as zombies or orphans."""
+    for p in procs:
+        try:
+            p.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            p.terminate()
+            try:
+                p.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+
+
+class StreamFanout:
+    """One yt-dlp | ffmpeg pipeline whose output is replayed to every client.
+
+    A pump thread drains ffmpeg into a shared chunk list and each client
+    reads it at its own cursor, so a slow reader only falls behind instead
+    of stalling ffmpeg or the other clients. The pump stops reading once
+    even the fastest client is STREAM_AHEAD_BYTES behind, which lets pipe
+    backpressure throttle ffmpeg and yt-dlp. Late joiners replay from byte 0
+    until the buffer outgrows STREAM_HISTORY_BYTES and gets trimmed; a
+    client that falls more than STREAM_HISTORY_BYTES behind the fastest one
+    is dropped, so a stalled reader can't pin the whole output in memory.
+
+    The output is also teed to disk and published to the cache when the
+    pipeline exits cleanly.
+    """
+
+    def __init__(self, key: str, title: str, audio_format: str, bitrate: str, plan,
+                 procs: list, stdout):
+        self.key = key
+        self.title = title
+        self.audio_format = audio_format
+        self.labels = stage_labels("stream", audio_format, bitrate)
+        self.plan = plan
+        self.procs = procs
+        self.chunks = []
+        self.base = 0          # absolute index of chunks[0]
+        self.buffered = 0      # bytes held in chunks
+        self.cursors = {}      # client id -> absolute index of its next chunk
+        self.next_client = 0
+        self.done = False
+        self.cancelled = False
+        self.cond = threading.Condition()
+        self.timer = threading.Timer(STREAM_TIMEOUT, self.cancel)
+        self.timer.daemon = True
+        self.timer.start()
+        threading.Thread(target=self._pump, args=(stdout,), daemon=True).start()
+
+    def _lag(self) -> int:
+        """Bytes produced that the fastest client hasn't read yet."""
+        fastest = max(self.cursors.values())
+        return sum(len(c) for c in self.chunks[fastest - self.base:])
+
+    def _trim(self):
+        if self.buffered <= STREAM_HISTORY_BYTES or not self.cursors:
+            return
+        fastest = max(self.cursors.values())
+        behind = 0
+        for index in range(self.base + len(self.chunks) - 1, self.base - 1, -1):
+            if behind > STREAM_HISTORY_BYTES:
+                # everyone still parked at or before this chunk is too far back
+                for client, cursor in list(self.cursors.items()):
+                    if cursor <= index + 1 and cursor < fastest:
+                        app.logger.warning(f"Stream {self.title}: dropping stalled client {client}")
+                        del self.cursors[client]
+                break
+            behind += len(self.chunks[index - self.base])
+        drop = min(self.cursors.values()) - self.base
+        if drop > 0:
+            self.buffered -= sum(len(c) for c in self.chunks[:drop])
+            del self.chunks[:drop]
+            self.base += drop
+
+    def _pump(self, stdout):
+        start = time.perf_counter()
+        produced = 0
+        work_dir = tempfile.mkdtemp(prefix="work-", dir=DOWNLOAD_DIR)
+        tee_path = os.path.join(work_dir, f"{self.title}.{EXT_MAP[self.audio_format]}")
+        try:
+            with open(tee_path, "wb") as tee:
+                while True:
+                    with self.cond:
+                        while (not self.cancelled and self.cursors
+                               and self._lag() >= STREAM_AHEAD_BYTES):
+                            self.cond.wait(1)
+                        if self.cancelled:
+                            break
+                    # read1 returns whatever is ready, so bytes go out as soon as ffmpeg emits them
+                    chunk = stdout.read1(65536)
+                    if not chunk:
+                        break
+                    tee.write(chunk)
+                    produced += len(chunk)
+                    with self.cond:
+                        self.chunks.append(chunk)
+                        self.buffered += len(chunk)
+                        self._trim()
+                        self.cond.notify_all()
+            stdout.close()
+            reap(self.procs)
+            if not self.cancelled and all(p.returncode == 0 for p in self.procs):
+                cache_publish(self.key, tee_path, self.title, self.plan)
+                threading.Thread(target=evict_cache, daemon=True).start()
+        except Exception as e:
+            app.logger.error(f"Stream {self.title} failed: {e}")
+        finally:
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+            self.timer.cancel()
+            for p in self.procs:
+                if p.poll() is None:
+                    p.terminate()
+            reap(self.procs)
+            CHILD_PROCESSES.dec(len(self.procs))
+            exit_code = "cancelled" if self.cancelled else str(self.procs[0].returncode)
+            record_stage("stream", self.labels, time.perf_counter() - start, exit_code, produced)
+            self._retire()
+            shutil.rmtree(work_dir, ignore_errors=True)
+            release()
+
+    def _retire(self):
+        with streams_lock:
+            if inflight_streams.get(self.key) is self:
+                del inflight_streams[self.key]
+
+    def cancel(self):
+        """Stop the pipeline; the pump notices EOF and reaps the processes."""
+        with self.cond:
+            if self.done:
+                return
+            self.cancelled = True
+            self.cond.notify_all()
+        self._retire()
+        for p in self.procs:
+            if p.poll() is None:
+                p.terminate()
+
+    def attach(self):
+        """Register a client and return its id, or None once the start of the
+        stream is no longer buffered (the caller then starts a fresh pipeline)."""
+        with self.cond:
+            if self.base or self.cancelled:
+                return None
+            self.next_client += 1
+            self.cursors[self.next_client] = 0
+            return self.next_client
+
+    def generate(self, client: int, started: float):
+        pos = 0
+        try:
+            while True:
+                with self.cond:
+                    while (pos == self.base + len(self.chunks) and not self.done
+                           and client in self.cursors):
+                        self.cond.wait()
+                    if client not in self.cursors:
+                        return  # fell too far behind and was dropped
+                    if pos == self.base + len(self.chunks):
+                        if pos == 0:
+                            # nothing was ever produced; callers turn this into a 500
+                            codes = [p.returncode for p in self.procs]
+                            raise subprocess.CalledProcessError(
+                                next((c for c in codes if c), -1), "yt-dlp | ffmpeg")
+                        return
+                    chunk = self.chunks[pos - self.base]
+                    pos += 1
+                    self.cursors[client] = pos
+                    self._trim()
+                    self.cond.notify_all()  # may release the pump's backpressure wait
+                if pos == 1:
+                    stream_ttfb.append(time.monotonic() - started)
+                    STREAM_TTFB.labels(self.labels["format"], self.labels["bitrate"]).observe(
+                        time.monotonic() - started)
+                yield chunk
+        finally:
+            with self.cond:
+                self.cursors.pop(client, None)
+                abandoned = not self.cursors and not self.done
+            if abandoned:
+                # last listener left mid-stream: stop the pipeline
+                self.cancel()
+
+
+def resume_stream(first: bytes, gen):
+    """Re-attach an already-read first chunk; closing this closes gen, so a
+    disconnect still detaches the client."""
+    try:
+        yield first
+        yield from gen
+    finally:
+        gen.close()
 
 
 def streaming_download(youtube_url: str, audio_format: str, bitrate: str):
-    info = get_video_info(youtube_url)
+    """Start (or join) a live yt-dlp | ffmpeg pipeline.
+
+    Returns (generator, title), or None when the worker is at its
+    JOB_QUEUE_LIMIT and a new pipeline can't be admitted.
+    """
+    started = time.monotonic()
+    key = cache_key(youtube_url, audio_format, bitrate, "stream")
+    with streams_lock:
+        fanout = inflight_streams.get(key)
+        client = fanout.attach() if fanout else None
+        if client is not None:
+            return fanout.generate(client, started), fanout.title
+
+    # a title is all we need up front, so a /search pre-populated entry will do
+    info = get_video_info(youtube_url, full=False)
     title = info["title"]
 
-    yt_cmd = ["yt-dlp", "-f", "bestaudio/best",
-              "--no-warnings", youtube_url, "-o", "-"]
+    # with full info cached we can plan a stream copy, and replay the info
+    # over stdin instead of extracting the page again
+    plan = None
+    selector = FAST_SOURCE
+    source = [youtube_url]
+    if info["raw"] is not None:
+        plan = plan_conversion(info["formats"], audio_format, bitrate)
+        if plan["mode"] == "copy":
+            selector = plan["format_id"]
+        source = ["--load-info-json", "-"]
+
+    yt_cmd = ["yt-dlp", "-f", selector, "--no-playlist",
+              "--no-warnings", *source, "-o", "-"]
     ff_cmd = ["ffmpeg", "-hide_banner",
               "-loglevel", "error", "-i", "pipe:0", "-vn"]
+    if plan and plan["mode"] == "copy":
+        ff_cmd += ["-c:a", "copy"]
+    else:
+        ff_cmd += ffmpeg_codec_args(audio_format, bitrate)
+    ff_cmd += [*STREAM_CONTAINERS[audio_format], "pipe:1"]
 
-    if audio_format == "mp3":
-        ff_cmd += ["-c:a", "libmp3lame", "-b:a", f"{bitrate}k"]
-    elif audio_format == "aac":
-        ff_cmd += ["-c:a", "aac", "-b:a", f"{bitrate}k"]
-    ff_cmd += ["-f", audio_format, "pipe:1"]
+    with streams_lock:
+        # another request may have started the same stream while we fetched info
+        fanout = inflight_streams.get(key)
+        client = fanout.attach() if fanout else None
+        if client is None:
+            if not admit():
+                return None
+            try:
+                yt = subprocess.Popen(yt_cmd, stdout=subprocess.PIPE,
+                                      stdin=None if info["raw"] is None else subprocess.PIPE)
+                ff = subprocess.Popen(ff_cmd, stdin=yt.stdout, stdout=subprocess.PIPE)
+            except OSError:
+                release()
+                raise
+            CHILD_PROCESSES.inc(2)
+            yt.stdout.close()
+            if yt.stdin:
+                threading.Thread(target=feed_stdin, args=(yt.stdin, json.dumps(info["raw"]).encode()),
+                                 daemon=True).start()
+            fanout = StreamFanout(key, title, audio_format, bitrate, plan, [ff, yt], ff.stdout)
+            inflight_streams[key] = fanout
+            client = fanout.attach()
 
-    yt = subprocess.Popen(yt_cmd, stdout=subprocess.PIPE)
-    ff = subprocess.Popen(ff_cmd, stdin=yt.stdout, stdout=subprocess.PIPE)
-    yt.stdout.close()
+    return fanout.generate(client, started), fanout.title
 
-    def generate():
+
+def feed_stdin(pipe, data: bytes):
+    try:
+        pipe.write(data)
+        pipe.close()
+    except BrokenPipeError:
+        pass  # yt-dlp died early; ffmpeg will just see EOF
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+def remember_search(key: str, results: list, expires: float):
+    with search_lock:
+        search_cache[key] = (expires, results)
+        search_cache.move_to_end(key)
+        while len(search_cache) > SEARCH_CACHE_SIZE:
+            search_cache.popitem(last=False)
+
+
+def cached_search(key: str):
+    """Results for a search key from memory, else from the shared disk copy."""
+    now = time.time()
+    with search_lock:
+        entry = search_cache.get(key)
+        if entry and entry[0] > now:
+            search_cache.move_to_end(key)
+            return entry[1]
+        search_cache.pop(key, None)
+
+    path = os.path.join(SEARCH_DIR, f"{key}.json")
+    try:
+        expires = os.stat(path).st_mtime + SEARCH_CACHE_TTL
+        if expires <= now:
+            return None
+        with open(path) as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        return None
+    remember_search(key, results, expires)
+    return results
+
+
+def store_search(key: str, results: list):
+    remember_search(key, results, time.time() + SEARCH_CACHE_TTL)
+    path = os.path.join(SEARCH_DIR, f"{key}.json")
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(results, f)
+    os.replace(tmp, path)
+
+
+def evict_searches():
+    """Drop expired search files, then the oldest beyond SEARCH_CACHE_SIZE."""
+    now = time.time()
+    entries = []
+    for fn in os.listdir(SEARCH_DIR):
+        path = os.path.join(SEARCH_DIR, fn)
+        if not fn.endswith(".json"):
+            continue
         try:
-            while True:
-                chunk = ff.stdout.read(16384)
-                if not chunk:
-                    break
-                yield chunk
-        finally:
-            ff.terminate()
-            yt.terminate()
+            entries.append((os.stat(path).st_mtime, path))
+        except OSError:
+            continue
 
-    return generate(), title
+    entries.sort(reverse=True)
+    for n, (mtime, path) in enumerate(entries):
+        if n >= SEARCH_CACHE_SIZE or now - mtime > SEARCH_CACHE_TTL:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 
-@app.route('/search')
-def search():
-    q = request.args.get("query", "").strip()
-    if not q:
-        return abort(400, "Missing query")
-    proc = subprocess.run(
+def run_search(query: str) -> list:
+    proc = run_tool(
+        "search",
         ["yt-dlp",
          "--ignore-errors",
          "--quiet",
          "--dump-json",
          "--no-playlist",
          "--flat-playlist",
-         f"ytsearch8:{q}"],
+         f"ytsearch8:{query}"],
         capture_output=True, text=True, check=True, timeout=15
     )
     results = []
@@ -212,64 +1172,371 @@ def search():
             info = json.loads(line)
         except:
             continue
+        if info.get("webpage_url"):
+            # warm the metadata cache for the click that usually follows
+            remember_info(info["webpage_url"], info, full=False)
+        thumbnails = info.get("thumbnails") or []
         results.append({
             "title": info.get("title"),
             "url":   info.get("webpage_url"),
-            "thumbnail": info.get("thumbnails")[0].get("url"),
+            "thumbnail": thumbnails[0].get("url") if thumbnails else info.get("thumbnail"),
             "duration":  info.get("duration")
         })
-    return jsonify(results)
+    return results
 
 
-@app.route('/download')
-def download():
-    url = request.args.get("url", "").strip()
-    fmt = request.args.get("format", "mp3").strip().lower()
-    br = request.args.get("bitrate", "320").strip()
-    method = request.args.get("method", "auto").strip().lower()
+def prefetch_budget_left() -> bool:
+    cutoff = time.time() - 3600
+    with prefetch_lock:
+        while prefetch_bytes and prefetch_bytes[0][0] < cutoff:
+            prefetch_bytes.popleft()
+        return sum(size for _, size in prefetch_bytes) < PREFETCH_BYTES_PER_HOUR
+
+
+def prefetch_hit(url: str, vid: str, audio: bool):
+    try:
+        # requests that are actually waiting come first
+        if pending_jobs:
+            return
+        get_video_info(url)
+        if audio and not pending_jobs and prefetch_budget_left():
+            method = "fast" if PREFETCH_FORMAT in FAST_FORMATS else "quality"
+            if cache_lookup(cache_key(url, PREFETCH_FORMAT, PREFETCH_BITRATE, method)):
+                return
+            path, _ = convert(url, PREFETCH_FORMAT, PREFETCH_BITRATE, method)
+            with prefetch_lock:
+                prefetch_bytes.append((time.time(), os.path.getsize(path)))
+    except Exception as e:
+        app.logger.info(f"Prefetch of {url} skipped: {e}")
+    finally:
+        with prefetch_lock:
+            prefetching.discard(vid)
+
 
+def prefetch(results: list):
+    """Queue the top search hits for speculative prefetch."""
+    urls = [r["url"] for r in results if r.get("url")]
+    for n, url in enumerate(urls[:max(SEARCH_PREFETCH, SEARCH_PREFETCH_AUDIO)]):
+        vid = video_id(url)
+        with prefetch_lock:
+            # already queued, or typing is outrunning the pool
+            if vid in prefetching or len(prefetching) >= 4 * PREFETCH_CONCURRENCY:
+                continue
+            prefetching.add(vid)
+        prefetch_pool.submit(prefetch_hit, url, vid, n < SEARCH_PREFETCH_AUDIO)
+
+
+@app.route('/search')
+def search():
+    q = normalize_query(request.args.get("query", ""))
+    if not q:
+        return abort(400, "Missing query")
+    key = hashlib.sha256(q.encode()).hexdigest()[:32]
+    results = cached_search(key)
+    if results is None:
+        # identical queries in any worker wait for one yt-dlp run
+        with cache_lock(f"search-{key}"):
+            results = cached_search(key)
+            if results is None:
+                results = run_search(q)
+                if results:
+                    store_search(key, results)
+                    threading.Thread(target=evict_searches, daemon=True).start()
+    if SEARCH_PREFETCH or SEARCH_PREFETCH_AUDIO:
+        prefetch(results)
+    return jsonify(results)
+
+
+def download_args(stream_ok: bool = False):
+    """Read and validate url/format/bitrate/method from the query string."""
+    url = request.values.get("url", "").strip()
     if not url.startswith(("http://", "https://")):
-        return abort(400, "Invalid URL")
+        abort(400, "Invalid URL")
+    return (url, *format_args(stream_ok))
+
+
+def format_args(stream_ok: bool = False):
+    """Read and validate format/bitrate/method from the query string.
+
+    "auto" resolves to streaming where the endpoint can stream, else to the
+    fast or quality file pipeline.
+    """
+    fmt = request.values.get("format", "mp3").strip().lower()
+    br = request.values.get("bitrate", "320").strip()
+    method = request.values.get("method", "auto").strip().lower()
+
     if fmt not in ALLOWED_FORMATS:
-        return abort(400, "Unsupported format")
-    if fmt in FAST_FORMATS and br not in ALLOWED_BITRATE:
-        return abort(400, "Unsupported bitrate")
+        abort(400, "Unsupported format")
+    # every lossy target is encoded at (or capped to) this bitrate
+    if fmt not in LOSSLESS_FORMATS and br not in ALLOWED_BITRATE:
+        abort(400, "Unsupported bitrate")
 
-    try:
-        if method == "auto":
+    if method == "auto":
+        if stream_ok:
+            method = "stream"
+        else:
             method = "fast" if fmt in FAST_FORMATS else "quality"
+    return fmt, br, method
+
+
+def convert(url: str, fmt: str, br: str, method: str, progress=None):
+    """Produce (file_path, title) for a conversion, from the cache if possible."""
+    method = "fast" if method == "fast" else "quality"
+    key = cache_key(url, fmt, br, method)
+    hit = cache_lookup(key)
+    if hit:
+        return hit
+
+    with cache_lock(key):
+        # another gunicorn worker may have produced it while we waited
+        hit = cache_lookup(key)
+        if hit:
+            return hit
+
+        # private work dir so concurrent requests never see each other's files
+        work_dir = tempfile.mkdtemp(prefix="work-", dir=DOWNLOAD_DIR)
+        try:
+            if method == "fast":
+                file_path, title, plan = fast_download_ytdlp(url, fmt, br, work_dir, progress)
+            else:
+                file_path, title, plan = quality_download_ffmpeg(url, fmt, br, work_dir, progress)
+            app.logger.info(f"{title} -> {fmt}: {plan['mode']} from format {plan['format_id']}")
+            file_path = cache_publish(key, file_path, title, plan)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    threading.Thread(target=evict_cache, daemon=True).start()
+    return file_path, title
+
+
+def attachment(filename: str) -> str:
+    """Content-Disposition for a download, encoded the way send_file does it:
+    WSGI servers reject header values outside Latin-1, so non-ASCII titles
+    get an ASCII fallback plus an RFC 5987 filename*."""
+    try:
+        filename.encode("ascii")
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+        return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(filename, safe='')}"
 
-        if method == "stream" and fmt in FAST_FORMATS:
-            gen, title = streaming_download(url, fmt, br)
-            mime = "audio/mpeg" if fmt == "mp3" else "audio/aac"
+
+def send_audio(file_path: str, title: str):
+    ext = file_path.rsplit('.', 1)[1]
+    return send_file(
+        file_path,
+        as_attachment=True,
+        download_name=f"{title}.{ext}",
+        mimetype=MIME_TYPES.get(ext, "application/octet-stream")
+    )
+
+
+def write_job(job: dict):
+    # job files are shared by all gunicorn workers, so publish atomically
+    job["updated"] = time.time()
+    path = os.path.join(JOBS_DIR, f"{job['id']}.json")
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp, path)
+
+
+def read_job(job_id: str):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    try:
+        with open(os.path.join(JOBS_DIR, f"{job_id}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def submit_job(url: str, fmt: str, br: str, method: str):
+    """Queue a conversion on the matching pool.
+
+    Returns (job, future), or None when this worker already has
+    JOB_QUEUE_LIMIT jobs queued or running.
+    """
+    global pending_jobs
+    key = cache_key(url, fmt, br, "fast" if method == "fast" else "quality")
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "stage": None,
+        "percent": 0.0,
+        "format": fmt,
+        "method": method,
+        "title": None,
+        "error": None,
+        "key": key,
+        "plan": None,
+        "created": time.time(),
+    }
+
+    def progress(stage, percent):
+        # only hit the disk when the visible value changes
+        if stage != job["stage"] or int(percent) != int(job["percent"]):
+            job["stage"], job["percent"] = stage, round(percent, 1)
+            write_job(job)
+
+    def run():
+        global pending_jobs
+        try:
+            job["status"] = "running"
+            write_job(job)
+            _, job["title"] = convert(url, fmt, br, method, progress)
+            job["plan"] = cache_meta(key).get("plan")
+            job["status"], job["stage"], job["percent"] = "done", None, 100.0
+            write_job(job)
+            return job
+        except Exception as e:
+            app.logger.error(f"Job {job['id']} failed: {e}")
+            job["status"] = "error"
+            job["error"] = "Processing failed" if isinstance(
+                e, subprocess.CalledProcessError) else str(e)
+            write_job(job)
+            raise
+        finally:
+            with pending_lock:
+                pending_jobs -= 1
+                INFLIGHT_JOBS.dec()
+                if inflight_jobs.get(key, (None,))[0] is job:
+                    del inflight_jobs[key]
+
+    pool = fast_pool if method == "fast" else quality_pool
+    # check, publish and register in one critical section, so an identical
+    # request can't start a second pipeline and run() can't retire the key
+    # before it's added
+    with pending_lock:
+        if key in inflight_jobs:
+            return inflight_jobs[key]
+        if pending_jobs >= JOB_QUEUE_LIMIT:
+            return None
+        pending_jobs += 1
+        INFLIGHT_JOBS.inc()
+        write_job(job)
+        inflight_jobs[key] = (job, pool.submit(contextvars.copy_context().run, run))
+        return inflight_jobs[key]
+
+
+def admit() -> bool:
+    """Take a slot under JOB_QUEUE_LIMIT; pair every True with release()."""
+    global pending_jobs
+    with pending_lock:
+        if pending_jobs >= JOB_QUEUE_LIMIT:
+            return False
+        pending_jobs += 1
+        INFLIGHT_JOBS.inc()
+        return True
+
+
+def release():
+    global pending_jobs
+    with pending_lock:
+        pending_jobs -= 1
+        INFLIGHT_JOBS.dec()
+
+
+def submit_task(pool, fn, *args):
+    """Run fn on pool under the same admission limit as jobs; None if full."""
+    if not admit():
+        return None
+
+    def run():
+        try:
+            return fn(*args)
+        finally:
+            release()
+
+    return pool.submit(contextvars.copy_context().run, run)
+
+
+def queue_full():
+    resp = jsonify({"error": "Too many conversions in progress, try again shortly"})
+    resp.status_code = 429
+    # rough guess: one pool's worth of jobs finishes every half minute
+    backlog = pending_jobs / max(FAST_CONCURRENCY + QUALITY_CONCURRENCY, 1)
+    resp.headers["Retry-After"] = str(int(30 * max(backlog, 1)))
+    return resp
+
+
+@app.route('/download')
+def download():
+    url, fmt, br, method = download_args(stream_ok=True)
+
+    try:
+        if method == "stream":
+            # any finished file beats a live pipeline. Stream output comes
+            # last: ffmpeg wrote it to a pipe, so WAV sizes and FLAC sample
+            # counts/MD5 in its headers were never filled in
+            for cached in ("quality", "fast", "stream"):
+                hit = cache_lookup(cache_key(url, fmt, br, cached))
+                if hit:
+                    return send_audio(*hit)
+
+            started = streaming_download(url, fmt, br)
+            if started is None:
+                return queue_full()
+            gen, title = started
+            # wait for the first chunk, so a pipeline that dies before any
+            # output (a 403, a missing format) is a 500 and not an empty file
+            first = next(gen)
+            ext = EXT_MAP[fmt]
             return Response(
-                gen(),
-                mimetype=mime,
+                resume_stream(first, gen),
+                mimetype=MIME_TYPES[ext],
                 headers={
-                    "Content-Disposition": f'attachment; filename="{title}.{fmt}"'}
+                    "Content-Disposition": attachment(f"{title}.{ext}"),
+                    "X-Accel-Buffering": "no"}
             )
-        elif method == "fast":
-            file_path, title = fast_download_ytdlp(url, fmt, br)
-        else:
-            file_path, title = quality_download_ffmpeg(url, fmt, br)
-
-        response = send_file(
-            file_path,
-            as_attachment=True,
-            download_name=f"{title}.{file_path.rsplit('.', 1)[1]}",
-            mimetype={
-                "mp3": "audio/mpeg",
-                "aac": "audio/aac",
-                "alac": "audio/mp4",
-                "flac": "audio/flac",
-                "wav": "audio/wav",
-                "ogg": "audio/ogg"
-            }[fmt]
-        )
-
-        threading.Thread(target=wipe_downloads, args=(1,), daemon=True).start()
-        return response
 
+        hit = cache_lookup(cache_key(url, fmt, br, "fast" if method == "fast" else "quality"))
+        if hit:
+            return send_audio(*hit)
+
+        # run on the bounded pools too, so inline downloads respect the same limits
+        submitted = submit_job(url, fmt, br, method)
+        if submitted is None:
+            return queue_full()
+        job, future = submitted
+        future.result()
+        return send_audio(*cache_lookup(job["key"]))
+
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Processing error: {e}")
+        return abort(500, "Processing failed")
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {e}")
+        return abort(500, str(e))
+
+
+def batch_targets(spec: str) -> list:
+    """Parse "mp3:320,flac,ogg:192" into [(format, bitrate)]."""
+    targets = []
+    for item in spec.split(","):
+        fmt, _, br = item.strip().lower().partition(":")
+        br = br or "320"
+        if fmt not in ALLOWED_FORMATS:
+            abort(400, f"Unsupported format: {fmt}")
+        if br not in ALLOWED_BITRATE:
+            abort(400, f"Unsupported bitrate: {br}")
+        targets.append((fmt, br))
+    if len(targets) > BATCH_MAX_TARGETS:
+        abort(400, "Too many targets")
+    return targets
+
+
+@app.route('/batch', methods=["GET", "POST"])
+def batch():
+    url = request.values.get("url", "").strip()
+    if not url.startswith(("http://", "https://")):
+        return abort(400, "Invalid URL")
+    targets = batch_targets(request.values.get("targets", "mp3:320"))
+
+    future = submit_task(quality_pool, batch_convert, url, targets)
+    if future is None:
+        return queue_full()
+    try:
+        results = future.result()
     except subprocess.CalledProcessError as e:
         app.logger.error(f"Processing error: {e}")
         return abort(500, "Processing failed")
@@ -277,6 +1544,347 @@ def download():
         app.logger.error(f"Unexpected error: {e}")
         return abort(500, str(e))
 
+    # open now so a concurrent eviction can't pull files out from under the zip
+    title = results[0][3]
+    ext_count = {}
+    for fmt, _, _, _ in results:
+        ext_count[EXT_MAP[fmt]] = ext_count.get(EXT_MAP[fmt], 0) + 1
+    entries = []
+    for fmt, br, path, _ in results:
+        ext = EXT_MAP[fmt]
+        name = title
+        if ext_count[ext] > 1:
+            name += f" ({fmt})" if fmt in LOSSLESS_FORMATS else f" ({fmt} {br}k)"
+        entries.append((f"{name}.{ext}", open(path, "rb")))
+
+    return Response(
+        stream_zip(entries),
+        mimetype="application/zip",
+        headers={"Content-Disposition": attachment(f"{title}.zip")}
+    )
+
+
+def expand_playlist(playlist_url: str) -> list:
+    """List a playlist's entries as [(url, title)] without resolving each one."""
+    proc = run_tool(
+        "playlist",
+        ["yt-dlp",
+         "--flat-playlist",
+         "--dump-json",
+         "--ignore-errors",
+         "--no-warnings",
+         "--playlist-end", str(PLAYLIST_MAX_ENTRIES),
+         playlist_url],
+        capture_output=True, text=True, timeout=60
+    )
+    entries = []
+    for line in proc.stdout.splitlines():
+        try:
+            info = json.loads(line)
+        except ValueError:
+            continue
+        url = info.get("webpage_url") or info.get("url") or ""
+        if url.startswith(("http://", "https://")):
+            remember_info(url, info, full=False)
+        entries.append((url, info.get("title")))
+    if not entries and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return entries
+
+
+def host_slot(url: str) -> threading.BoundedSemaphore:
+    """Per-host limit, so one bulk request can't hammer a single site."""
+    host = urlparse(url).hostname or ""
+    with host_slots_lock:
+        if host not in host_slots:
+            host_slots[host] = threading.BoundedSemaphore(PLAYLIST_PER_HOST)
+        return host_slots[host]
+
+
+def playlist_entries(entries: list, fmt: str, br: str, method: str, manifest: dict):
+    """Convert entries in parallel, yielding zip members as each one finishes.
+
+    Entries run on the shared fast/quality pools, at most
+    PLAYLIST_CONCURRENCY at a time so a long playlist can't crowd out
+    other users' jobs. Failures are recorded in the manifest, which is
+    yielded last.
+    """
+    def convert_entry(url):
+        if not url.startswith(("http://", "https://")):
+            raise ValueError("Invalid URL")
+        file_path, title = convert(url, fmt, br, method)
+        # open right away so eviction can't remove it before it is zipped
+        return open(file_path, "rb"), title, file_path.rsplit(".", 1)[1]
+
+    def submit(i, url):
+        # take the host slot here, not in a pool thread, so waiting on it
+        # never ties up a shared worker
+        slot = host_slot(url)
+        slot.acquire()
+        future = pool.submit(convert_entry, url)
+        future.add_done_callback(lambda _: slot.release())
+        futures[future] = i
+
+    width = len(str(len(entries)))
+    pool = fast_pool if method == "fast" else quality_pool
+    todo = iter(enumerate(entries))
+    futures = {}
+    try:
+        while True:
+            for i, (url, _) in todo:
+                submit(i, url)
+                if len(futures) >= PLAYLIST_CONCURRENCY:
+                    break
+            if not futures:
+                break
+            future = next(as_completed(futures))
+            i = futures.pop(future)
+            record = manifest["entries"][i]
+            try:
+                f, title, ext = future.result()
+            except Exception as e:
+                app.logger.error(f"Playlist entry {record['url']} failed: {e}")
+                record["status"] = "error"
+                record["error"] = "Processing failed" if isinstance(
+                    e, subprocess.CalledProcessError) else str(e)
+                continue
+            record["status"] = "ok"
+            record["file"] = f"{i + 1:0{width}d} - {title}.{ext}"
+            yield record["file"], f
+    finally:
+        # client went away: drop whatever hasn't started
+        for future in futures:
+            future.cancel()
+
+    yield "manifest.json", json.dumps(manifest, indent=2).encode()
+
+
+@app.route('/playlist', methods=["GET", "POST"])
+def playlist():
+    fmt, br, method = format_args()
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get("urls")
+    if isinstance(body, list):
+        urls = body
+    else:
+        # ?urls=a&urls=b, or one whitespace-separated form field
+        urls = [u for v in request.values.getlist("urls") for u in v.split()]
+    url = request.values.get("url", "").strip()
+
+    try:
+        if urls:
+            entries = [(str(u).strip(), None) for u in urls]
+        elif url.startswith(("http://", "https://")):
+            entries = expand_playlist(url)
+        else:
+            return abort(400, "Invalid URL")
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Processing error: {e}")
+        return abort(500, "Processing failed")
+    if not entries:
+        return abort(404, "Playlist is empty")
+    if len(entries) > PLAYLIST_MAX_ENTRIES:
+        return abort(400, "Too many entries")
+
+    if not admit():
+        return queue_full()
+
+    manifest = {
+        "source": url or None,
+        "format": fmt,
+        "bitrate": br,
+        "entries": [{"url": u, "title": t, "status": "pending"} for u, t in entries]
+    }
+
+    def generate():
+        try:
+            yield from stream_zip(playlist_entries(entries, fmt, br, method, manifest))
+        finally:
+            release()
+
+    return Response(
+        generate(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="playlist.zip"'}
+    )
+
+
+@app.route('/jobs', methods=["POST"])
+def create_job():
+    url, fmt, br, method = download_args()
+    if method == "stream":
+        return abort(400, "Streaming is not available as a job")
+
+    submitted = submit_job(url, fmt, br, method)
+    if submitted is None:
+        return queue_full()
+    job, _ = submitted
+    resp = jsonify(job)
+    resp.status_code = 202
+    resp.headers["Location"] = f"/jobs/{job['id']}"
+    return resp
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = read_job(job_id)
+    if job is None:
+        return abort(404, "Unknown job")
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    global event_streams
+    if read_job(job_id) is None:
+        return abort(404, "Unknown job")
+    with pending_lock:
+        if event_streams >= EVENT_STREAMS_MAX:
+            resp = jsonify({"error": "Too many progress streams, poll /jobs/<id> instead"})
+            resp.status_code = 429
+            resp.headers["Retry-After"] = "5"
+            return resp
+        event_streams += 1
+
+    def done():
+        global event_streams
+        with pending_lock:
+            event_streams -= 1
+
+    def generate():
+        last, idle = None, 0.0
+        while True:
+            job = read_job(job_id)
+            if job is None:
+                break
+            if job != last:
+                yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+                last, idle = job, 0.0
+                if job["status"] in ("done", "error"):
+                    break
+            elif idle >= 15:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            time.sleep(0.5)
+            idle += 0.5
+
+    resp = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # runs even if the client leaves before the generator starts
+    resp.call_on_close(done)
+    return resp
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = read_job(job_id)
+    if job is None:
+        return abort(404, "Unknown job")
+    if job["status"] == "error":
+        return abort(500, job["error"])
+    if job["status"] != "done":
+        return abort(409, "Job not finished")
+    hit = cache_lookup(job["key"])
+    if hit is None:
+        return abort(410, "Result expired")
+    return send_audio(*hit)
+
+
+@app.route('/plan')
+def conversion_plan():
+    # resolve "auto" exactly as /download does, so the plan is the one that runs
+    url, fmt, br, method = download_args(stream_ok=True)
+    try:
+        info = get_video_info(url)
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Processing error: {e}")
+        return abort(500, "Processing failed")
+    # fast mode lets yt-dlp decide, and it copies regardless of bitrate
+    result = plan_conversion(info["formats"], fmt, None if method == "fast" else br)
+    result["method"] = method
+    return jsonify(result)
+
+
+class DiskUsageCollector:
+    """DOWNLOAD_DIR usage, measured when /metrics is scraped."""
+
+    def collect(self):
+        total = 0
+        for root, _, files in os.walk(DOWNLOAD_DIR):
+            for fn in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, fn))
+                except OSError:
+                    pass
+        yield GaugeMetricFamily("soundscape_download_dir_bytes",
+                                "Bytes on disk under DOWNLOAD_DIR", value=total)
+
+
+@app.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    stage_timings.set([])
+
+
+@app.after_request
+def add_timing(response):
+    timings = stage_timings.get() or []
+    elapsed = time.perf_counter() - g.started
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    parts.append(f"app;dur={elapsed * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(parts)
+
+    # label values come from the client, so only pass through known ones
+    fmt = request.values.get("format", "")
+    method = request.values.get("method", "")
+    labels = stage_labels(
+        method if method in {"auto", "fast", "quality", "stream"} else "",
+        fmt if fmt in ALLOWED_FORMATS else "",
+        request.values.get("bitrate", "") if request.values.get("bitrate") in ALLOWED_BITRATE else "")
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    status = str(response.status_code)
+    started, sent_from = g.started, time.perf_counter()
+
+    def on_close():
+        # runs once the body (file or stream) has been fully sent
+        done = time.perf_counter()
+        if endpoint in ("/download", "/jobs/<job_id>/result", "/batch", "/playlist"):
+            record_stage("send", labels, done - sent_from)
+        REQUEST_SECONDS.labels(endpoint=endpoint, status=status, **labels).observe(done - started)
+
+    response.call_on_close(on_close)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(DiskUsageCollector())
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+@app.route('/stats')
+def stats():
+    samples = sorted(stream_ttfb)
+
+    def pct(p):
+        return round(samples[min(int(len(samples) * p), len(samples) - 1)], 3) if samples else None
+
+    return jsonify({
+        "stream_ttfb_seconds": {
+            "count": len(samples),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "max": round(samples[-1], 3) if samples else None
+        },
+        "active_streams": len(inflight_streams)
+    })
+
 
 @app.route('/formats')
 def formats():
@@ -288,16 +1896,87 @@ def formats():
     })
 
 
+# Vite puts content-hashed bundles under assets/, so they never change
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+COMPRESSIBLE_TYPES = {"application/javascript", "text/javascript", "application/json",
+                      "application/manifest+json", "application/xml", "image/svg+xml",
+                      "application/wasm"}
+
+
+def load_asset(path: str) -> dict:
+    """Read one build file and its compressed variants.
+
+    Variants come from .br/.gz siblings when the build made them; otherwise
+    they are compressed here once, and kept only if they are smaller.
+    """
+    with open(path, "rb") as f:
+        body = f.read()
+    mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    variants = {"identity": (body, digest)}
+
+    if len(body) >= 1024 and (mime.startswith("text/") or mime in COMPRESSIBLE_TYPES):
+        compressors = {"gzip": (".gz", lambda b: gzip.compress(b, 9, mtime=0))}
+        if brotli:
+            compressors["br"] = (".br", brotli.compress)
+        for encoding, (suffix, compress) in compressors.items():
+            if os.path.isfile(path + suffix):
+                with open(path + suffix, "rb") as f:
+                    encoded = f.read()
+            else:
+                encoded = compress(body)
+            if len(encoded) < len(body):
+                variants[encoding] = (encoded, f"{digest}-{encoding}")
+    return {"mime": mime, "variants": variants}
+
+
+def build_asset_index() -> dict:
+    """Map every file in BUILD_DIR (relative path) to its loaded asset.
+
+    Built once at startup so requests for the SPA never touch the disk.
+    """
+    index = {}
+    for root, _, files in os.walk(BUILD_DIR):
+        for fn in files:
+            if fn.endswith((".gz", ".br")):
+                continue
+            path = os.path.join(root, fn)
+            rel = os.path.relpath(path, BUILD_DIR).replace(os.sep, "/")
+            asset = load_asset(path)
+            asset["cache"] = IMMUTABLE_CACHE if rel.startswith("assets/") else "no-cache"
+            index[rel] = asset
+    return index
+
+
+assets = build_asset_index()
+
+
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
 def serve_spa(path):
-    # 1) If requesting a real file (e.g. /favicon.ico or /assets/foo.js), serve it
-    file_path = os.path.join(BUILD_DIR, path)
-    if path and os.path.isfile(file_path):
-        return send_from_directory(BUILD_DIR, path)
+    # Real files (e.g. /favicon.ico or /assets/foo.js) are served as-is;
+    # anything else gets index.html so the client-side router can take over
+    asset = assets.get(path) or assets.get("index.html")
+    if asset is None:
+        return abort(404)
+
+    variants = asset["variants"]
+    accepted = request.accept_encodings
+    # highest q wins; on a tie brotli, being listed first, is preferred
+    offered = [e for e in ("br", "gzip") if e in variants and accepted.quality(e) > 0]
+    encoding = max(offered, key=accepted.quality, default="identity")
+    body, etag = variants[encoding]
 
-    # 2) Otherwise, always serve index.html so the client-side router can take over
-    return send_from_directory(BUILD_DIR, "index.html")
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype=asset["mime"])
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = asset["cache"]
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
 
 
 if __name__ == "__main__":
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Offline load benchmark for app.py.
+
+Starts the app under gunicorn with bench/stubs first on PATH, so yt-dlp and
+ffmpeg are replaced by canned, delay-configurable stand-ins (optionally
+backed by a real ffmpeg for encode cost). It then drives /search,
+/download (fast, quality, stream) and /formats at a fixed concurrency.
+
+Per scenario it reports p50/p95/p99 latency, time to first byte and
+throughput. It also reports peak RSS of the gunicorn process tree and any
+stub processes left running, or zombies, after the scenario. Results are
+written as JSON.
+
+    python bench/run.py --concurrency 8 --requests 40
+    python bench/run.py --real-ffmpeg --scenarios quality,stream
+    python bench/run.py --compare bench/results/old.json bench/results/new.json
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+SCENARIOS = {
+    "formats": lambda n: "/formats",
+    "search":  lambda n: f"/search?query=bench+query+{n}",
+    "fast":    lambda n: f"/download?url={video_url(n, 'f')}&format=mp3&bitrate=192&method=fast",
+    "quality": lambda n: f"/download?url={video_url(n, 'q')}&format=flac&method=quality",
+    "stream":  lambda n: f"/download?url={video_url(n, 's')}&format=mp3&bitrate=192&method=stream",
+}
+DEFAULT_SCENARIOS = "formats,search,fast,quality,stream"
+METRICS = ["p50", "p95", "p99"]
+
+# set from --distinct: how many different videos requests cycle through
+distinct_videos = 0
+run_id = ""
+
+
+def video_url(n: int, scenario: str) -> str:
+    # ids are unique per run and scenario, so every scenario starts with a
+    # cold cache and can't be served from another scenario's output
+    if distinct_videos:
+        n %= distinct_videos
+    return f"https://www.youtube.com/watch?v={run_id}{scenario}{n:07d}"
+
+
+def percentile(samples: list, p: float):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(int(len(samples) * p), len(samples) - 1)], 4)
+
+
+def summarize(samples: list) -> dict:
+    return {"p50": percentile(samples, 0.50),
+            "p95": percentile(samples, 0.95),
+            "p99": percentile(samples, 0.99),
+            "max": round(max(samples), 4) if samples else None}
+
+
+def fetch(port: int, path: str, timeout: float) -> dict:
+    start = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        size = len(resp.read(1))
+        ttfb = time.perf_counter() - start
+        while True:
+            chunk = resp.read(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+        conn.close()
+        return {"status": resp.status, "ttfb": ttfb,
+                "latency": time.perf_counter() - start, "bytes": size}
+    except (OSError, http.client.HTTPException) as e:
+        return {"status": None, "error": str(e),
+                "latency": time.perf_counter() - start, "bytes": 0}
+
+
+# ── process accounting (Linux /proc) ─────────────────────────────────────
+
+def proc_table() -> dict:
+    """pid -> (ppid, state, cmdline) for every visible process."""
+    table = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+        except OSError:
+            continue
+        # the command name may contain spaces, so split after its closing paren
+        fields = stat[stat.rindex(")") + 2:].split()
+        table[int(pid)] = (int(fields[1]), fields[0], cmdline)
+    return table
+
+
+def descendants(root: int, table: dict) -> set:
+    tree, frontier = {root}, [root]
+    while frontier:
+        parent = frontier.pop()
+        for pid, (ppid, _, _) in table.items():
+            if ppid == parent and pid not in tree:
+                tree.add(pid)
+                frontier.append(pid)
+    return tree
+
+
+def rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Tracks peak combined RSS of the gunicorn tree, children included."""
+
+    def __init__(self, root: int, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.root = root
+        self.interval = interval
+        self.peak_kb = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            tree = descendants(self.root, proc_table())
+            self.peak_kb = max(self.peak_kb, sum(rss_kb(pid) for pid in tree))
+            self.stopped.wait(self.interval)
+
+    def reset(self) -> int:
+        peak, self.peak_kb = self.peak_kb, 0
+        return peak
+
+
+def leftover_processes(root: int) -> dict:
+    """Stub processes still alive, and zombies under gunicorn, right now."""
+    table = proc_table()
+    tree = descendants(root, table)
+    lingering = [pid for pid, (_, state, cmd) in table.items()
+                 if STUBS_DIR in cmd and state != "Z"]
+    zombies = [pid for pid in tree if table.get(pid, (0, ""))[1] == "Z"]
+    return {"lingering_children": len(lingering), "zombies": len(zombies)}
+
+
+# ── runner ───────────────────────────────────────────────────────────────
+
+def make_fixture(path: str, real_ffmpeg: str, duration: float, size: int):
+    if real_ffmpeg:
+        subprocess.run([real_ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+                        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                        "-ac", "2", "-c:a", "aac", "-b:a", "128k", path], check=True)
+    else:
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+
+
+def start_server(args, work_dir: str, env: dict):
+    cmd = [sys.executable, "-m", "gunicorn", "app:app",
+           "--config", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+           "--bind", f"127.0.0.1:{args.port}",
+           "--workers", str(args.workers),
+           "--worker-class", "gthread", "--threads", str(args.threads),
+           "--timeout", "600"]
+    log = open(os.path.join(work_dir, "gunicorn.log"), "w")
+    # cwd decides where app.py puts downloads/, so run from the temp dir and
+    # find app.py through PYTHONPATH instead
+    env = dict(env, PYTHONPATH=REPO_DIR + os.pathsep + env.get("PYTHONPATH", ""))
+    server = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=log, stderr=log)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"gunicorn exited, see {log.name}")
+        if fetch(args.port, "/formats", 2).get("status") == 200:
+            return server
+        time.sleep(0.2)
+    server.terminate()
+    sys.exit("gunicorn did not come up within 30s")
+
+
+def run_scenario(name: str, args, sampler: RssSampler, root: int) -> dict:
+    make_path = SCENARIOS[name]
+    sampler.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(lambda n: fetch(args.port, make_path(n), args.timeout),
+                                range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    time.sleep(args.settle)  # give cancelled pipelines a moment to be reaped
+    ok = [r for r in results if r["status"] == 200]
+    errors = {}
+    for r in results:
+        if r["status"] != 200:
+            label = str(r["status"] or r.get("error"))
+            errors[label] = errors.get(label, 0) + 1
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+        "latency_s": summarize([r["latency"] for r in ok]),
+        "ttfb_s": summarize([r["ttfb"] for r in ok]),
+        "bytes": sum(r["bytes"] for r in ok),
+        "peak_rss_mb": round(sampler.reset() / 1024, 1),
+        **leftover_processes(root),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    global distinct_videos, run_id
+    distinct_videos = args.distinct
+    run_id = f"{int(time.time()) % 10 ** 3:03d}"
+
+    real_ffmpeg = None
+    if args.real_ffmpeg:
+        real_ffmpeg = shutil.which("ffmpeg", path=os.environ["PATH"].replace(STUBS_DIR, ""))
+        if not real_ffmpeg:
+            sys.exit("--real-ffmpeg given but no ffmpeg found on PATH")
+
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    fixture = os.path.join(work_dir, "fixture.m4a")
+    make_fixture(fixture, real_ffmpeg, args.duration, args.fixture_kb * 1024)
+
+    env = dict(os.environ)
+    env.update({
+        "PATH": STUBS_DIR + os.pathsep + env.get("PATH", ""),
+        "BENCH_FIXTURE": fixture,
+        "BENCH_DURATION": str(args.duration),
+        "BENCH_SEARCH_DELAY": str(args.search_delay),
+        "BENCH_INFO_DELAY": str(args.info_delay),
+        "BENCH_DOWNLOAD_DELAY": str(args.download_delay),
+        "BENCH_DOWNLOAD_RATE": str(args.download_rate),
+        "BENCH_ENCODE_DELAY": str(args.encode_delay),
+    })
+    if real_ffmpeg:
+        env["BENCH_REAL_FFMPEG"] = real_ffmpeg
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    server = start_server(args, work_dir, env)
+    sampler = RssSampler(server.pid)
+    sampler.start()
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "args": {k: v for k, v in vars(args).items() if k != "compare"},
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in args.scenarios.split(","):
+            print(f"running {name} ...", flush=True)
+            result = run_scenario(name, args, sampler, server.pid)
+            report["scenarios"][name] = result
+            print(f"  p50 {result['latency_s']['p50']}s  p95 {result['latency_s']['p95']}s  "
+                  f"ttfb p50 {result['ttfb_s']['p50']}s  {result['throughput_rps']} req/s  "
+                  f"ok {result['ok']}/{result['requests']}  rss {result['peak_rss_mb']} MB  "
+                  f"leftover {result['lingering_children']}+{result['zombies']}Z", flush=True)
+    finally:
+        sampler.stopped.set()
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {out}")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)["scenarios"]
+    with open(new_path) as f:
+        new = json.load(f)["scenarios"]
+
+    def delta(a, b):
+        if a is None or b is None:
+            return "n/a"
+        return f"{a:.3f} -> {b:.3f} ({(b - a) / a * 100:+.0f}%)" if a else f"{a} -> {b}"
+
+    for name in sorted(set(old) & set(new)):
+        o, n = old[name], new[name]
+        print(name)
+        for m in METRICS:
+            print(f"  latency {m}: {delta(o['latency_s'][m], n['latency_s'][m])}")
+        print(f"  ttfb p50:    {delta(o['ttfb_s']['p50'], n['ttfb_s']['p50'])}")
+        print(f"  throughput:  {delta(o['throughput_rps'], n['throughput_rps'])}")
+        print(f"  peak rss MB: {delta(o['peak_rss_mb'], n['peak_rss_mb'])}")
+        print(f"  leftover:    {o['lingering_children']}+{o['zombies']}Z -> "
+              f"{n['lingering_children']}+{n['zombies']}Z")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--scenarios", default=DEFAULT_SCENARIOS,
+                   help=f"comma-separated subset of {DEFAULT_SCENARIOS}")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--requests", type=int, default=40, help="requests per scenario")
+    p.add_argument("--distinct", type=int, default=0,
+                   help="videos to cycle through (0 = every request is a new video)")
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--port", type=int, default=5055)
+    p.add_argument("--timeout", type=float, default=300, help="per-request timeout")
+    p.add_argument("--settle", type=float, default=2,
+                   help="seconds to wait before counting leftover processes")
+    p.add_argument("--real-ffmpeg", action="store_true",
+                   help="pass ffmpeg calls to the real binary to measure encode cost")
+    p.add_argument("--duration", type=float, default=180, help="fixture length in seconds")
+    p.add_argument("--fixture-kb", type=int, default=4096,
+                   help="fixture size when not generated by a real ffmpeg")
+    p.add_argument("--search-delay", type=float, default=1.0)
+    p.add_argument("--info-delay", type=float, default=1.0)
+    p.add_argument("--download-delay", type=float, default=0.3)
+    p.add_argument("--download-rate", type=float, default=2_000_000, help="bytes/s, 0 = unlimited")
+    p.add_argument("--encode-delay", type=float, default=1.0,
+                   help="simulated seconds to encode the whole fixture (stub ffmpeg only)")
+    p.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                   help="extra environment for the app, e.g. QUALITY_CONCURRENCY=2")
+    p.add_argument("--out", help="results file (default bench/results/bench-<time>.json)")
+    p.add_argument("--keep", action="store_true", help="keep the temp dir with logs and downloads")
+    p.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                   help="print the difference between two result files and exit")
+    args = p.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
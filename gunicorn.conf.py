@@ -0,0 +1,28 @@
+# gunicorn settings shared by the Dockerfile and bench/run.py.
+# Workers write their Prometheus metrics to files in PROMETHEUS_MULTIPROC_DIR
+# so /metrics can sum them no matter which worker answers the scrape.
+import os
+import shutil
+
+# Must be set before prometheus_client is first imported: it picks in-memory
+# or file-backed metric values once, at import, and the workers inherit
+# that choice from this (master) process.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/soundscape-metrics")
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    # stale files from a previous run would be counted again
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # app.py sizes its job and SSE limits from the request thread count
+    os.environ["WORKER_THREADS"] = str(server.cfg.threads)